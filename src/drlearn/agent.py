@@ -79,9 +79,11 @@ class Agent:
             # examples of the iteration
             if not self.skip_first_self_play or i > 1:
                 iteration_train_examples = deque([], maxlen=self.args.maxlen_of_queue)
+                # the network is fixed during self play, so its predictions are shared by all the search trees
+                leaf_cache = {}
 
                 for j in tqdm(range(self.args.games_sim), desc="Self Play"):
-                    self.mcts = MCTS(self.game, self.nnet, self.nnet, self.args)  # reset search tree
+                    self.mcts = MCTS(self.game, self.nnet, self.nnet, self.args, leaf_cache)  # reset search tree
                     iteration_train_examples += self.simulate_game()
 
                 # save the iteration examples to the history
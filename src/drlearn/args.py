@@ -12,8 +12,10 @@ args = DotDict({
     'update_threshold': 0.6,  # During arena playoff, new neural net will be accepted if threshold or more of games are won.
     'maxlen_of_queue': 200000,  # Number of game examples to train the neural networks.
     'num_mcts_sims': 25,  # Number of game moves for MCTS to simulate.
+    'mcts_batch_size': 1,  # Number of MCTS simulations whose leaves are evaluated by the network in one batch.
     'games_eval': 50,  # Number of games to play during arena play to determine if new net will be accepted.
     'cpuct': 1,
+    'rule_based_dealer': False,  # The dealer follows the house rule instead of a trained model.
 
     'checkpoint': './temp/',
     'load_model': False,
@@ -32,6 +34,8 @@ nnargs = DotDict({
     'batch_size': 64,
     'cuda': False,
     'num_channels': 512,
+    'onnx': True,  # Run inference with onnxruntime when it is installed.
+    'quantize': False,  # Run inference with int8 weights for the linear layers.
 })
 
 
@@ -43,6 +47,8 @@ def parse_args():
     parser.add_argument("--games_sim", type=int, help="number of simulated games for each iteration")
     parser.add_argument("--epochs", type=int, help="number of epochs for training")
     parser.add_argument("--channels", type=int, help="number of channels for the neural network")
+    parser.add_argument("--quantize", action="store_true", help="run inference with int8 weights")
+    parser.add_argument("--rule_based_dealer", action="store_true", help="let the dealer follow the house rule")
     parser.add_argument("--log_level", type=str, help="logging level", default='INFO')
     parser.add_argument("--eval", action="store_true", help="evaluate against self")
     parser.add_argument("--play", action="store_true", help="play against human")
@@ -68,6 +74,10 @@ def parse_args():
         nnargs.epochs = inargs.epochs
     if inargs.channels:
         nnargs.num_channels = inargs.channels
+    if inargs.quantize:
+        nnargs.quantize = True
+    if inargs.rule_based_dealer:
+        args.rule_based_dealer = True
 
 
 def main(game, nnet, mcts, agent=None):
@@ -7,15 +7,17 @@ from drlearn.blackjack import BlackJackAgent
 if __name__ == "__main__":
     nnargs.num_channels = 512
     args.num_mcts_sims = 50
+    args.mcts_batch_size = 8
     args.games_sim = 100
     parse_args()
-    game = BlackJack()
+    game = BlackJack(rule_based_dealer=args.rule_based_dealer)
     nnet = BlackJackModel(game, nnargs)
-    dealer_nnet = BlackJackModel(game, nnargs)
+    dealer_nnet = None if game.rule_based_opponent else BlackJackModel(game, nnargs)
     mcts = MCTS(game, nnet, dealer_nnet, args)
     agent = None
     if args.eval or args.play:
-        dealer_nnet.load_checkpoint(folder=args.checkpoint, filename='bestd.pth')
+        if not game.rule_based_opponent:
+            dealer_nnet.load_checkpoint(folder=args.checkpoint, filename='bestd.pth')
     else:
         agent = BlackJackAgent(game, nnet, dealer_nnet, mcts, args, nnargs)
     main(game, nnet, mcts, agent)
\ No newline at end of file
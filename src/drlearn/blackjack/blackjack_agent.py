@@ -13,38 +13,51 @@ class BlackJackAgent(Agent):
         self.nnet = nnet
         self.pnet = self.nnet.__class__(self.game, nnargs)
         self.dealer_nnet = dealer_nnet
-        self.dealer_pnet = self.nnet.__class__(self.game, nnargs)
+        # a rule based dealer is not trained, so it needs no previous version
+        self.train_dealer = not self.game.rule_based_opponent
+        self.dealer_pnet = self.nnet.__class__(self.game, nnargs) if self.train_dealer else None
         self.args = args
         self.mcts = mcts
         self.train_examples_history = []
         self.skip_first_self_play = False
+        # the steps of a game are written here by simulate_game. both hands together cannot hold more than
+        # 22 cards without a bust, so a game takes fewer than 32 steps
+        self._ep_states = np.empty((32, self.game.n + 1), dtype=np.int16)
+        self._ep_pis = np.empty((32, self.game.get_action_size()), dtype=np.float32)
+        self._ep_players = np.empty(32, dtype=np.int8)
 
     def simulate_game(self):
-        train_examples = []
         state = self.game.get_init_state()
         current_player = state[2]
         step = 0
 
         while True:
-            step += 1
-            temp = int(step < self.args.temp_threshold)
+            temp = int(step + 1 < self.args.temp_threshold)
             pi = self.mcts.get_action_prob(state, temp=temp)
             state0, state1, _, _ = self.game.to_neural_state(state)
-            train_examples.append([state0, current_player, pi])
+            self._ep_states[step] = state0
+            self._ep_pis[step] = pi
+            self._ep_players[step] = current_player
+            step += 1
             action = np.random.choice(len(pi), p=pi)
             state = self.game.get_next_state(state, current_player, action)
             current_player = state[2]
             r = state[3]
             if r != 0:
-                return [(x[0], x[2], x[1], x[1]) for x in train_examples]
+                # the buffers are reused by the next game, so the steps of this one are copied out at once
+                states = self._ep_states[:step].copy()
+                pis = self._ep_pis[:step].copy()
+                players = self._ep_players[:step].tolist()
+                return list(zip(states, pis, players, players))
 
     def learn(self):
         for i in range(1, self.args.num_iters + 1):
             logging.info(f'Starting Iter #{i} ...')
             if not self.skip_first_self_play or i > 1:
                 iteration_train_examples = deque([], maxlen=self.args.maxlen_of_queue)
+                leaf_cache = {}
                 for j in tqdm(range(self.args.games_sim), desc="Self Play"):
-                    self.mcts = MCTS(self.game, self.nnet, self.dealer_nnet, self.args)
+                    self.mcts = MCTS(self.game, self.nnet, self.dealer_nnet, self.args, leaf_cache)
                     iteration_train_examples += self.simulate_game()
                 self.train_examples_history.append(iteration_train_examples)
             if len(self.train_examples_history) > self.args.num_iters_for_train_examples_history:
@@ -56,28 +69,33 @@ class BlackJackAgent(Agent):
             shuffle(train_examples)
             self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth')
             self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth')
-            self.dealer_nnet.save_checkpoint(folder=self.args.checkpoint, filename='tempd.pth')
-            self.dealer_pnet.load_checkpoint(folder=self.args.checkpoint, filename='tempd.pth')
+            if self.train_dealer:
+                self.dealer_nnet.save_checkpoint(folder=self.args.checkpoint, filename='tempd.pth')
+                self.dealer_pnet.load_checkpoint(folder=self.args.checkpoint, filename='tempd.pth')
             pmcts = MCTS(self.game, self.pnet, self.dealer_pnet, self.args)
             player_examples = [(x[0], x[1], x[2]) for x in train_examples if x[3] == 1]
-            dealer_examples = [(x[0], x[1], x[2]) for x in train_examples if x[3] == -1]
             self.nnet.fit(player_examples)
-            self.dealer_nnet.fit(dealer_examples)
+            if self.train_dealer:
+                dealer_examples = [(x[0], x[1], x[2]) for x in train_examples if x[3] == -1]
+                self.dealer_nnet.fit(dealer_examples)
             nmcts = MCTS(self.game, self.nnet, self.dealer_nnet, self.args)
             logging.info('PLAYING AGAINST PREVIOUS VERSION')
             arena = Arena(lambda x: np.argmax(nmcts.get_action_prob(x, temp=0)), lambda x: np.argmax(pmcts.get_action_prob(x, temp=0)), self.game)
             nwins, pwins, draws = arena.eval_games(self.args.games_eval)
             if i == 1:
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth')
-                self.dealer_nnet.save_checkpoint(folder=self.args.checkpoint, filename='bestd.pth')
+                if self.train_dealer:
+                    self.dealer_nnet.save_checkpoint(folder=self.args.checkpoint, filename='bestd.pth')
                 self.save_train_examples(i - 1, best=True)
             logging.info('NEW/PREV WINS : %d / %d ; DRAWS : %d' % (nwins, pwins, draws))
             if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.args.update_threshold:
                 logging.info('REJECTING NEW MODEL')
                 self.nnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth')
-                self.dealer_nnet.load_checkpoint(folder=self.args.checkpoint, filename='tempd.pth')
+                if self.train_dealer:
+                    self.dealer_nnet.load_checkpoint(folder=self.args.checkpoint, filename='tempd.pth')
             else:
                 logging.info('ACCEPTING NEW MODEL')
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth')
-                self.dealer_nnet.save_checkpoint(folder=self.args.checkpoint, filename='bestd.pth')
+                if self.train_dealer:
+                    self.dealer_nnet.save_checkpoint(folder=self.args.checkpoint, filename='bestd.pth')
                 self.save_train_examples(i - 1, best=True)
\ No newline at end of file
@@ -1,6 +1,5 @@
 import numpy as np
-import random
-import copy
+from collections import namedtuple
 
 from drlearn.game import Game
 
@@ -8,41 +7,54 @@ ACTION_HIT = 0
 ACTION_STAND = 1
 PLAYER = 1
 DEALER = -1
+# cards are stored as indices into SUITE, the labels are only used for display
+SUITE = ('A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K')
+INDEX_MAP = {k: i for i, k in enumerate(SUITE)}
+CARD_VALUES = (1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10)
+
+# cards: the count of each card (ignoring the suits) in the hand of the current player, as a read-only array
+# other_cards: the same for the other hand
+# key: the zobrist hash returned by get_state_key
+# dealer_first_value: the value of the dealer's visible card, which the counts cannot tell apart
+BlackJackState = namedtuple('BlackJackState', ['cards', 'other_cards', 'current_player', 'reward', 'key', 'dealer_first_value'])
 
 class BlackJack(Game):
-    def __init__(self):
-        super().__init__(alternate_turn=False, player_agnostic_state=False)
+    def __init__(self, rule_based_dealer=False):
+        # with rule_based_dealer, the dealer follows the house rule of standing from 17 on instead of a trained model
+        super().__init__(alternate_turn=False, player_agnostic_state=False, rule_based_opponent=rule_based_dealer)
         self.n = 13
+        # zobrist keys for get_state_key: one per (card, count in the player's hand), per value of the dealer's
+        # first card, per value of the dealer's hand and per turn. they are xor-ed in and out on each transition
+        zobrist = np.random.SeedSequence(0).generate_state(self.n * 5 + 11 + 32 + 2, dtype=np.uint64).tolist()
+        self._zobrist_cards = [zobrist[i * 5:(i + 1) * 5] for i in range(self.n)]
+        self._zobrist_first = zobrist[self.n * 5:self.n * 5 + 11]
+        self._zobrist_dealer = zobrist[self.n * 5 + 11:self.n * 5 + 43]
+        self._zobrist_turn = {PLAYER: zobrist[-2], DEALER: zobrist[-1]}
+        self._scratch_player = np.empty(self.n + 1, dtype=np.int16)
+        self._scratch_dealer = np.empty(self.n + 1, dtype=np.int16)
+        self._deck = np.tile(np.arange(self.n, dtype=np.int8), 4)
         self.reset()
 
     def reset(self):
-        self.suite = ['A', '2', '3', '4', '5', '6', '7', '8', '9', '10', 'J', 'Q', 'K']
-        self.deck = self.suite * 4
-        random.shuffle(self.deck)
+        # only the first four cards of the deck are dealt, the next ones are drawn from the counts left
+        np.random.shuffle(self._deck)
+        deck = self._deck[:4].tolist()
         self.current_player = 1
-        self.player_hand = [self.deck.pop(), self.deck.pop()]
-        self.dealer_hand = [self.deck.pop(), self.deck.pop()]
-        self.index_map = {k: i for i, k in enumerate(self.suite)}
-        self.card_values = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 10, 10, 10])
+        self.player_hand = (deck[0], deck[1])
+        self.dealer_hand = (deck[2], deck[3])
 
     def get_init_state(self):
         self.reset()
-        return self.player_hand, self.dealer_hand, self.current_player, 0
+        return self._make_state(self.player_hand, self.dealer_hand, self.current_player, 0)
 
     def to_neural_state(self, state):
-        current_player = state[2]
-        player, dealer = 0, 1
-        if current_player == -1:
-            player, dealer = 1, 0
-        player_state = np.zeros(self.n + 1, dtype=int)
-        for card in state[player]:
-            player_state[self.index_map[card]] += 1
-        player_state[self.n] = self.card_values[self.index_map[state[dealer][0]]]
-        dealer_state = np.zeros(self.n + 1, dtype=int)
-        for card in state[dealer]:
-            dealer_state[self.index_map[card]] += 1
-        dealer_state[self.n] = max(self._get_value(player_state))
-        return (player_state, dealer_state, state[2], state[3]) if current_player == 1 else (dealer_state, player_state, state[2], state[3])
+        '''
+        the neural states are written into two buffers of the game, which are overwritten by the next call.
+        a caller keeping them has to copy them
+        '''
+        if state[2] == -1:
+            return self._to_neural_state_dealer(state)
+        return self._to_neural_state_player(state)
 
     def get_shape(self):
         return self.n, self.n
@@ -51,45 +63,52 @@ class BlackJack(Game):
         return 2
 
     def get_next_state(self, state, player, action):
-        state0 = copy.copy(state[0])
-        state1 = copy.copy(state[1])
+        cards, other_cards, current_player, _, key, dealer_first_value = state
         if action == ACTION_HIT:
             card = self._deal_next_card(state)
-            state0.append(card)
-            state_np, _, _, _ = self.to_neural_state((state0, state1, state[2], state[3]))
-            if min(self._get_value(state_np)) > 21:
+            if current_player == -1:
+                key ^= self._zobrist_dealer[self._get_value(cards)]
+                cards = self._add_card(cards, card)
+                value = self._get_value(cards)
+                key ^= self._zobrist_dealer[value]
+            else:
+                cards = self._add_card(cards, card)
+                value = self._get_value(cards)
+                count = int(cards[card])
+                key ^= self._zobrist_cards[card][count - 1] ^ self._zobrist_cards[card][count]
+            if value > 21:
                 reward = -player if player == 1 else player
-                return state0, state1, state[2], reward
+                return BlackJackState(cards, other_cards, current_player, reward, key, dealer_first_value)
             else:
-                return state0, state1, state[2], 0
+                return BlackJackState(cards, other_cards, current_player, 0, key, dealer_first_value)
         else:
             if player == 1:
-                return state1, state0, -1, 0
-            dealer_state, player_state, _, _ = self.to_neural_state(state)
-            dealer_sum = max(self._get_value(dealer_state))
-            player_sum = max(self._get_value(player_state))
+                key ^= self._zobrist_first[dealer_first_value] ^ self._zobrist_dealer[self._get_value(other_cards)]
+                key ^= self._zobrist_turn[PLAYER] ^ self._zobrist_turn[DEALER]
+                return BlackJackState(other_cards, cards, -1, 0, key, dealer_first_value)
+            dealer_sum = self._get_value(cards)
+            player_sum = self._get_value(other_cards)
             if player_sum > dealer_sum:
-                return state0, state1, state[2], -1
+                return BlackJackState(cards, other_cards, current_player, -1, key, dealer_first_value)
             elif player_sum == dealer_sum:
-                return state0, state1, state[2], 1e-4
+                return BlackJackState(cards, other_cards, current_player, 1e-4, key, dealer_first_value)
             else:
-                return state0, state1, state[2], 1
+                return BlackJackState(cards, other_cards, current_player, 1, key, dealer_first_value)
 
     def get_valid_actions(self, state, player):
         valids = [1] * self.get_action_size()
         current_player = state[2]
+        value = self._get_value(state[0])
         if current_player == -1:
-            dealer_state, player_state, _, _ = self.to_neural_state(state)
-            dealer_value = self._get_value(dealer_state)
-            if max(dealer_value) < 17:
+            if value < 17:
                 valids[1] = 0
-            elif min(dealer_value) > 21:
+            elif value > 21:
                 valids[0] = 0
                 valids[1] = 0
+            elif self.rule_based_opponent:
+                valids[0] = 0
         else:
-            player_state, dealer_state, _, _ = self.to_neural_state(state)
-            player_value = self._get_value(player_state)
-            if min(player_value) > 21:
+            if value > 21:
                 valids[0] = 0
                 valids[1] = 0
         return np.array(valids)
@@ -106,14 +125,17 @@ class BlackJack(Game):
     def state_to_string(self, state):
         current_player = state[2]
         if current_player == 1:
-            dealer_str = str(self.card_values[self.index_map[state[1][0]]])
-            player_state, _, _, _ = self.to_neural_state(state)
+            dealer_str = str(state.dealer_first_value)
+            player_state, _, _, _ = self._to_neural_state_player(state)
             return ''.join([str(v) for k, v in enumerate(player_state[:-1])]) + ":" + dealer_str + ":" + str(current_player)
         else:
-            dealer_state, player_state, _, _ = self.to_neural_state(state)
-            dealer_value = max(self._get_value(dealer_state))
+            dealer_state, player_state, _, _ = self._to_neural_state_dealer(state)
+            dealer_value = self._get_value(dealer_state)
             return ''.join([str(v) for k, v in enumerate(player_state[:-1])]) + ":" + str(dealer_value) + ":" + str(current_player)
 
+    def get_state_key(self, state):
+        return state.key
+
     def play(self, state):
         valid = self.get_valid_actions(state, 1)
         str = f"Enter 0 for hit\n" if valid[0] else f""
@@ -127,35 +149,93 @@ class BlackJack(Game):
             else:
                 print('Invalid')
         return a
-    
-    @staticmethod
-    def display(state):
-        player_state, dealer_state, current_player, _ = state
+
+    def make_state(self, hand0, hand1, current_player=PLAYER, reward=0):
+        '''
+        build a state from card labels, e.g. make_state(['10', '7'], ['9', 'A'])
+        '''
+        hand0 = [INDEX_MAP[card] for card in hand0]
+        hand1 = [INDEX_MAP[card] for card in hand1]
+        return self._make_state(hand0, hand1, current_player, reward)
+
+    def display(self, state):
+        player_state, dealer_state, current_player = state[:3]
         if current_player == -1:
-            dealer_state, player_state, _, _ = state
-            dealer_str = ','.join(x for x in dealer_state)
+            dealer_state, player_state = state[:2]
+            dealer_str = self._cards_to_string(dealer_state)
         else:
-            dealer_str = dealer_state[0]
+            dealer_str = 'A' if state.dealer_first_value == 1 else str(state.dealer_first_value)
         print(f"dealer: {dealer_str}")
-        player_str = ','.join(x for x in player_state)
+        player_str = self._cards_to_string(player_state)
         print(f"player: {player_str}\n")
 
+    def _to_neural_state_player(self, state):
+        # during the player's turn: the player's cards are state[0] and the dealer's state[1]
+        player_state = self._scratch_player
+        player_state[:self.n] = state[0]
+        player_state[self.n] = state.dealer_first_value
+        dealer_state = self._scratch_dealer
+        dealer_state[:self.n] = state[1]
+        dealer_state[self.n] = self._get_value(state[0])
+        return player_state, dealer_state, state[2], state[3]
+
+    def _to_neural_state_dealer(self, state):
+        # during the dealer's turn: the dealer's cards are state[0] and the player's state[1]
+        player_state = self._scratch_player
+        player_state[:self.n] = state[1]
+        player_state[self.n] = state.dealer_first_value
+        dealer_state = self._scratch_dealer
+        dealer_state[:self.n] = state[0]
+        dealer_state[self.n] = self._get_value(state[1])
+        return dealer_state, player_state, state[2], state[3]
+
+    def _make_state(self, hand0, hand1, current_player, reward):
+        # hand0 and hand1 are the card indices in the hands, the dealer's first one being visible
+        dealer_first_value = CARD_VALUES[hand0[0] if current_player == -1 else hand1[0]]
+        cards = self._count_cards(hand0)
+        other_cards = self._count_cards(hand1)
+        key = self._get_key(cards, other_cards, current_player, dealer_first_value)
+        return BlackJackState(cards, other_cards, current_player, reward, key, dealer_first_value)
+
+    def _count_cards(self, hand):
+        cards = np.bincount(hand, minlength=self.n).astype(np.int8)
+        cards.setflags(write=False)
+        return cards
+
+    def _add_card(self, cards, card):
+        # the counts are shared by the states of the tree, so they are copied and kept read-only
+        cards = cards.copy()
+        cards[card] += 1
+        cards.setflags(write=False)
+        return cards
+
+    def _cards_to_string(self, cards):
+        return ','.join(SUITE[x] for x in np.repeat(np.arange(self.n), cards))
+
     def _deal_next_card(self, state):
-        cards = {k: 4 for k in self.suite}
-        for hand in range(2):
-            for card in state[hand]:
-                cards[card] -= 1
-        keys = list(cards.keys())
-        weights = list(cards.values())
-        total_weight = sum(weights)
-        probabilities = [w / total_weight for w in weights]
-        card = random.choices(keys, weights=probabilities, k=1)
-        return card[0]
+        # draw uniformly from the cards left in the deck: the first card whose cumulative count exceeds
+        # a random number below the number of cards left
+        cards = np.cumsum(4 - state[0] - state[1])
+        return int(np.searchsorted(cards, np.random.randint(cards[-1]), side='right'))
+
+    def _get_key(self, cards, other_cards, current_player, dealer_first_value):
+        # hashes what state_to_string encodes: the player's cards, and the value of the dealer's first card
+        # during the player's turn or the value of the dealer's hand during the dealer's turn
+        if current_player == -1:
+            player_cards = other_cards
+            key = self._zobrist_dealer[self._get_value(cards)] ^ self._zobrist_turn[DEALER]
+        else:
+            player_cards = cards
+            key = self._zobrist_first[dealer_first_value] ^ self._zobrist_turn[PLAYER]
+        for card, count in enumerate(player_cards.tolist()):
+            key ^= self._zobrist_cards[card][count]
+        return key
 
     def _get_value(self, state):
-        base_value = np.sum(state[:-1] * self.card_values)
-        num_aces = state[0]
-        if num_aces == 0 or base_value > 21:
-            return [base_value]
-        possible_values = [base_value + 10 * i for i in range(num_aces + 1) if base_value + 10 * i <= 21]
-        return possible_values
\ No newline at end of file
+        # best value of the hand: at most one ace can count as 11 without busting
+        c = state[:self.n].tolist()
+        base_value = (c[0] + 2 * c[1] + 3 * c[2] + 4 * c[3] + 5 * c[4] + 6 * c[5] + 7 * c[6] + 8 * c[7] + 9 * c[8]
+                      + 10 * (c[9] + c[10] + c[11] + c[12]))
+        if c[0] == 0 or base_value > 11:
+            return base_value
+        return base_value + 10
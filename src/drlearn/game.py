@@ -4,9 +4,11 @@ This class needs to be subclassed by the specific game.
 '''
 
 class Game:
-    def __init__(self, alternate_turn=True, player_agnostic_state=True):
+    def __init__(self, alternate_turn=True, player_agnostic_state=True, rule_based_opponent=False):
         self.alternate_turn = alternate_turn
         self.player_agnostic_state = player_agnostic_state
+        # the opponent (current_player -1) picks uniformly among its valid actions instead of using a model
+        self.rule_based_opponent = rule_based_opponent
         
     def get_init_state(self):
         '''
@@ -29,6 +31,7 @@ class Game:
         input state: (player_state, opponent_state, current_player, reward)
         output state: (player_neural_state, opponent_neural_state, current_player, reward)
             a neural state is a numpy array which can be fed to the neural network model
+            it may be a buffer reused by the next call, so it needs to be copied to be kept
         if the game has player agnostic state, the opponent_state is the same as the player state
         '''
         pass
@@ -81,10 +84,17 @@ class Game:
 
     def state_to_string(self, state):
         '''
-        this returns a string representation of the state, which needs to be unique, as it is used as the key to the dictionaries in MCTS
+        this returns a string representation of the state, which needs to be unique
         '''
         pass
 
+    def get_state_key(self, state):
+        '''
+        this returns a cheap hashable key of the state, which needs to be unique, as it is used as the key to the dictionaries in MCTS.
+        states with the same key must have the same valid actions. by default it is the string representation
+        '''
+        return self.state_to_string(state)
+
     @staticmethod
     def display(state):
         '''
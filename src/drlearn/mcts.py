@@ -2,7 +2,43 @@ import numpy as np
 import logging
 import math
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional
+    njit = None
+
 EPS = 1e-8
+VIRTUAL_LOSS = 1
+
+
+def ucb_select(q, n, vloss, ns, ps, valids, cpuct):
+    # the valid action with the highest upper confidence bound, counting the virtual loss as visits
+    sqrt_ns = math.sqrt(ns + EPS)
+    return int(np.where(valids, q + cpuct * sqrt_ns * ps / (1 + n + vloss), -np.inf).argmax())
+
+
+def update_edge(q, n, a, v):
+    q[a] = (n[a] * q[a] + v) / (n[a] + 1)
+    n[a] += 1
+
+
+if njit is not None:
+    @njit(cache=True)
+    def ucb_select(q, n, vloss, ns, ps, valids, cpuct):
+        # compiled as a scalar loop, which avoids the temporary arrays of the vectorized version
+        cur_best = -np.inf
+        best_act = -1
+        sqrt_ns = math.sqrt(ns + EPS)
+        for a in range(q.shape[0]):
+            if valids[a]:
+                u = q[a] + cpuct * ps[a] * sqrt_ns / (1 + n[a] + vloss[a])
+                if u > cur_best:
+                    cur_best = u
+                    best_act = a
+        return best_act
+
+    update_edge = njit(cache=True)(update_edge)
+
 
 class MCTS:
     """
@@ -10,16 +46,21 @@ class MCTS:
     https://github.com/suragnair/alpha-zero-general
     """
 
-    def __init__(self, game, nnet, nnet_opponent, args):
+    def __init__(self, game, nnet, nnet_opponent, args, leaf_cache=None):
         self.game = game
         self.nnet = nnet
         self.nnet_opponent = nnet_opponent
         self.args = args
-        self.qsa = {}  # stores Q values for s,a (as defined in the paper)
-        self.nsa = {}  # stores #times edge s,a was visited
+        self.q = {}  # stores Q values of the edges of board s (as defined in the paper)
+        self.n = {}  # stores #times each edge of board s was visited
+        self.vloss = {}  # stores the virtual loss of the edges of board s while a batch of searches is in flight
         self.ns = {}  # stores #times board s was visited
         self.ps = {}  # stores initial policy (returned by neural net)
-        self.vs = {}  # stores game.get_valid_actions for board s
+        self.vs = {}  # stores game.get_valid_actions for board s, as a boolean mask
+        self.vns = {}  # stores the virtual loss of board s while a batch of searches is in flight
+        # stores (ps, v, valids) of expanded leaves by (s, current_player). it only depends on the networks,
+        # so trees searching with the same networks can share it
+        self.leaf_cache = {} if leaf_cache is None else leaf_cache
 
     def get_action_prob(self, state, temp=1):
         """
@@ -28,36 +69,40 @@ class MCTS:
 
         Returns:
             probs: a policy vector where the probability of the ith action is
-                   proportional to nsa[(s,a)]**(1./temp)
+                   proportional to n[s][a]**(1./temp)
         """
-        for i in range(self.args.num_mcts_sims):
+        batch_size = self.args.mcts_batch_size
+        if batch_size > 1:
+            # the root has to be expanded before the iterations of a batch can spread below it
             self.search(state)
+            for i in range(1, self.args.num_mcts_sims, batch_size):
+                self.search_batch(state, min(batch_size, self.args.num_mcts_sims - i))
+        else:
+            for i in range(self.args.num_mcts_sims):
+                self.search(state)
 
-        s = self.game.state_to_string(state)
-        counts = [self.nsa[(s, a)] if (s, a) in self.nsa else 0 for a in range(self.game.get_action_size())]
+        s = self.game.get_state_key(state)
+        counts = self.n[s].astype(np.float32) if s in self.n else np.zeros(self.game.get_action_size(), dtype=np.float32)
 
         if temp == 0:
-            best_as = np.array(np.argwhere(counts == np.max(counts))).flatten()
-            best_a = np.random.choice(best_as)
-            probs = [0] * len(counts)
-            probs[best_a] = 1
+            probs = np.zeros(len(counts), dtype=np.float32)
+            probs[np.random.choice(np.flatnonzero(counts == counts.max()))] = 1
             return probs
 
-        counts = [x ** (1. / temp) for x in counts]
-        counts_sum = float(sum(counts))
-        probs = [x / counts_sum for x in counts]
-        return probs
+        counts **= 1. / temp
+        counts /= counts.sum()
+        return counts
 
     def search(self, state):
         """
-        This function performs one iteration of MCTS. It is recursively called
+        This function performs one iteration of MCTS. It descends from state
         till a leaf node is found. The action chosen at each node is one that
         has the maximum upper confidence bound as in the paper.
 
         Once a leaf node is found, the neural network is called to return an
         initial policy P and a value v for the state. This value is propagated
         up the search path. In case the leaf node is a terminal state, the
-        outcome is propagated up the search path. The values of ns, nsa, qsa are
+        outcome is propagated up the search path. The values of ns, n, q are
         updated.
 
         NOTE: the return values are the negative of the value of the current
@@ -67,71 +112,147 @@ class MCTS:
         Returns:
             v: the negative of the value of the current state
         """
-
-        s = self.game.state_to_string(state)
-        current_player = state[2]
-        # 1 for alternate turn
-        player = 1 if self.game.alternate_turn else current_player
-        v = self.game.get_game_ended(state, player)
-        if v != 0:
-            # terminal node
-            return -v if self.game.alternate_turn else v
-
-        if s not in self.ps:
+        path, leaf_state, v = self.select_leaf(state)
+        if v is None:
             # leaf node
-            state_np = self.game.to_neural_state(state)
-            state_in = state_np[0]
+            s = self.game.get_state_key(leaf_state)
+            current_player = leaf_state[2]
+            player = 1 if self.game.alternate_turn else current_player
+            state_in = self.game.to_neural_state(leaf_state)[0]
             if current_player == 1:
-                self.ps[s], v = self.nnet.predict(state_in)
+                ps, v = self.nnet.predict(state_in)
             else:
-                self.ps[s], v = self.nnet_opponent.predict(state_in)
-            valids = self.game.get_valid_actions(state, player)
-            self.ps[s] = self.ps[s] * valids  # masking invalid moves
-            sum_ps_s = np.sum(self.ps[s])
-            if sum_ps_s > 0:
-                self.ps[s] /= sum_ps_s  # renormalize
+                ps, v = self.nnet_opponent.predict(state_in)
+            v = self.add_leaf(leaf_state, s, current_player, player, ps, v)[1]
+            v = -v if self.game.alternate_turn else v
+        return self.backup(path, v)
+
+    def search_batch(self, state, batch_size):
+        """
+        This function performs batch_size iterations of MCTS starting from
+        state, like search, but the leaves they reach are evaluated with a
+        single call to the neural network of each player.
+
+        A virtual loss is added to the visit counts along the path of each
+        iteration until its value is backed up, so that the iterations of a
+        batch spread over different paths of the tree.
+        """
+        pending = {}  # leaf s -> (leaf state, paths reaching it)
+        for _ in range(batch_size):
+            path, leaf_state, v = self.select_leaf(state)
+            if v is not None:
+                self.backup(path, v)
+                continue
+            s = self.game.get_state_key(leaf_state)
+            if s in pending:
+                pending[s][1].append(path)
             else:
-                logging.error("All valid moves were masked, doing a workaround.")
-                self.ps[s] = self.ps[s] + valids
-                self.ps[s] /= np.sum(self.ps[s])
+                pending[s] = (leaf_state, [path])
 
-            self.ns[s] = 0
-            return -v if self.game.alternate_turn else v
+        for current_player, nnet in (1, self.nnet), (-1, self.nnet_opponent):
+            leaves = [(s, leaf) for s, leaf in pending.items() if leaf[0][2] == current_player]
+            if not leaves:
+                continue
+            # the neural states may share a buffer of the game, so each one is copied before the next is built
+            states_in = np.stack([np.copy(self.game.to_neural_state(leaf_state)[0]) for _, (leaf_state, _) in leaves])
+            pis, vs = nnet.predict_batch(states_in)
+            player = 1 if self.game.alternate_turn else current_player
+            for (s, (leaf_state, paths)), ps, v in zip(leaves, pis, vs):
+                v = self.add_leaf(leaf_state, s, current_player, player, ps, v)[1]
+                v = -v if self.game.alternate_turn else v
+                for path in paths:
+                    self.backup(path, v)
 
-        valids = self.game.get_valid_actions(state, player)
-        cur_best = -float('inf')
-        best_act = -1
+    def select_leaf(self, state):
+        """
+        Descends from state, picking the actions with the highest upper
+        confidence bound and adding a virtual loss along the way, until a
+        terminal node or a node which is not expanded yet is found.
 
-        # pick the action with the highest upper confidence bound
-        for a in range(self.game.get_action_size()):
-            if valids[a]:
-                if (s, a) in self.qsa:
-                    u = self.qsa[(s, a)] + self.args.cpuct * self.ps[s][a] * math.sqrt(self.ns[s]) / (
-                            1 + self.nsa[(s, a)])
+        Returns:
+            path: the (s, a, flip) edges taken, flip telling if the value
+                  changes sign between s and the next node
+            state: the node where the descent stopped
+            v: the value to back up as returned by search, or None if the
+               node has to be evaluated by the neural network
+        """
+        path = []
+        while True:
+            s = self.game.get_state_key(state)
+            current_player = state[2]
+            player = 1 if self.game.alternate_turn else current_player
+            v = self.game.get_game_ended(state, player)
+            if v != 0:
+                # terminal node
+                return path, state, -v if self.game.alternate_turn else v
+
+            if s not in self.ps:
+                leaf = self.leaf_cache.get((s, current_player))
+                if leaf is not None:
+                    self.expand(s, leaf)
+                elif current_player == -1 and self.game.rule_based_opponent:
+                    # the opponent plays its valid actions uniformly, there is no model to evaluate it
+                    ps = np.ones(self.game.get_action_size(), dtype=np.float32)
+                    leaf = self.add_leaf(state, s, current_player, player, ps, (0.,))
                 else:
-                    u = self.args.cpuct * self.ps[s][a] * math.sqrt(self.ns[s] + EPS)  # Q = 0 ?
+                    return path, state, None
+                v = leaf[1]
+                return path, state, -v if self.game.alternate_turn else v
 
-                if u > cur_best:
-                    cur_best = u
-                    best_act = a
+            a = self.select_action(s)
+            self.vloss[s][a] += VIRTUAL_LOSS
+            self.vns[s] = self.vns.get(s, 0) + VIRTUAL_LOSS
+            next_s = self.game.get_next_state(state, player, a)
+            next_player = next_s[2]
+            if self.game.player_agnostic_state:
+                next_s = self.game.get_player_agnostic_state(next_s, next_player)
+            path.append((s, a, not self.game.alternate_turn and current_player != next_player))
+            state = next_s
 
-        a = best_act
-        next_s = self.game.get_next_state(state, player, a)
-        next_player = next_s[2]
-        if self.game.player_agnostic_state:
-            next_s = self.game.get_player_agnostic_state(next_s, next_player)
+    def backup(self, path, v):
+        """
+        Propagates v, as returned by search at the end of path, up the path
+        and removes the virtual loss added by select_leaf.
 
-        v = self.search(next_s)
-        if not self.game.alternate_turn and current_player != next_player:
-            v = -v
+        Returns:
+            v: the value propagated to the start of path, as returned by search
+        """
+        for s, a, flip in reversed(path):
+            if flip:
+                v = -v
+            self.vloss[s][a] -= VIRTUAL_LOSS
+            self.vns[s] -= VIRTUAL_LOSS
+            self.update(s, a, v)
+            v = -v if self.game.alternate_turn else v
+        return v
+
+    def select_action(self, s):
+        ns = self.ns[s] + self.vns.get(s, 0)
+        return ucb_select(self.q[s], self.n[s], self.vloss[s], ns, self.ps[s], self.vs[s], self.args.cpuct)
 
-        if (s, a) in self.qsa:
-            self.qsa[(s, a)] = (self.nsa[(s, a)] * self.qsa[(s, a)] + v) / (self.nsa[(s, a)] + 1)
-            self.nsa[(s, a)] += 1
+    def update(self, s, a, v):
+        update_edge(self.q[s], self.n[s], a, v)
+        self.ns[s] += 1
 
+    def add_leaf(self, state, s, current_player, player, ps, v):
+        # masks and renormalizes the policy predicted for a new leaf, then expands it
+        valids = self.game.get_valid_actions(state, player).astype(bool)
+        ps = ps * valids  # masking invalid moves
+        sum_ps_s = np.sum(ps)
+        if sum_ps_s > 0:
+            ps /= sum_ps_s  # renormalize
         else:
-            self.qsa[(s, a)] = v
-            self.nsa[(s, a)] = 1
+            logging.error("All valid moves were masked, doing a workaround.")
+            ps = ps + valids
+            ps /= np.sum(ps)
+        leaf = self.leaf_cache[(s, current_player)] = (ps, float(v[0]), valids)
+        self.expand(s, leaf)
+        return leaf
 
-        self.ns[s] += 1
-        return -v if self.game.alternate_turn else v
\ No newline at end of file
+    def expand(self, s, leaf):
+        self.ps[s], _, self.vs[s] = leaf
+        action_size = self.game.get_action_size()
+        self.q[s] = np.zeros(action_size, dtype=np.float32)
+        self.n[s] = np.zeros(action_size, dtype=np.int32)
+        self.vloss[s] = np.zeros(action_size, dtype=np.int32)
+        self.ns[s] = 0
@@ -4,10 +4,17 @@ import torch.nn as nn
 import torch.optim as optim
 import torch.nn.functional as F
 import logging
-import time
 import os
+import tempfile
 from tqdm import tqdm
 
+try:
+    import onnx
+    import onnxruntime as ort
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+except ImportError:  # onnxruntime is optional, predict then runs the torch model
+    ort = None
+
 from drlearn.utils import AverageMeter
 
 class NeuralNetModel(nn.Module):
@@ -18,12 +25,16 @@ class NeuralNetModel(nn.Module):
         super().__init__()
         if args.cuda:
             super().cuda()
+        # the onnxruntime session and the quantized copy of the current weights, built lazily by predict.
+        # a plain dict, so that the copy is not registered as a submodule and saved with the checkpoints
+        self.inference = {}
 
     def fit(self, examples):
         """
         examples: list of examples, each example is of form (state, pi, v)
         """
         optimizer = optim.Adam(self.parameters())
+        self.inference.clear()
 
         for epoch in range(self.args.epochs):
             logging.info('EPOCH ::: ' + str(epoch + 1))
@@ -65,19 +76,65 @@ class NeuralNetModel(nn.Module):
         """
         state: np array with state
         """
-        # timing
-        start = time.time()
+        pi, v = self.predict_batch(state)
+        return pi[0], v[0]
+
+    def predict_batch(self, states):
+        """
+        states: np array with a batch of states, or a single state
+        """
+        if ort is not None and self.args.onnx and not self.args.cuda:
+            # the exported graph skips the python, autograd and dispatcher overhead of torch
+            states = states.astype(np.float32).reshape(-1, *self.input_shape)
+            pi, v = self.get_session().run(None, {'x': states})
+            return np.exp(pi), v
 
         # preparing input
-        state = torch.FloatTensor(state.astype(np.float64))
-        if self.args.cuda: state = state.contiguous().cuda()
-        input_shape = (1, *self.input_shape)
-        state = state.view(input_shape)
-        super().eval()
-        with torch.no_grad():
-            pi, v = self(state)
+        states = torch.FloatTensor(states.astype(np.float64))
+        if self.args.cuda: states = states.contiguous().cuda()
+        states = states.view(-1, *self.input_shape)
+        model = self.get_quantized() if self.args.quantize and not self.args.cuda else self
+        model.eval()
+        with torch.inference_mode():
+            pi, v = model(states)
 
-        return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
+        return torch.exp(pi).data.cpu().numpy(), v.data.cpu().numpy()
+
+    def export_onnx(self, path):
+        """
+        exports the model in eval mode to an ONNX file, with input x and outputs pi, v of dynamic batch size
+        """
+        super().eval()
+        x = torch.zeros((1, *self.input_shape))
+        if self.args.cuda: x = x.cuda()
+        torch.onnx.export(self, (x,), path, verbose=False, input_names=['x'], output_names=['pi', 'v'],
+                          dynamic_axes={'x': {0: 'batch'}, 'pi': {0: 'batch'}, 'v': {0: 'batch'}})
+
+    def get_session(self):
+        if 'session' not in self.inference:
+            with tempfile.TemporaryDirectory() as folder:
+                path = os.path.join(folder, 'model.onnx')
+                self.export_onnx(path)
+                if self.args.quantize:
+                    # the shape inference of the quantizer trips over the shapes exported for the weights
+                    model = onnx.load(path)
+                    del model.graph.value_info[:]
+                    onnx.save(model, path)
+                    quantize_dynamic(path, os.path.join(folder, 'model.int8.onnx'), weight_type=QuantType.QInt8)
+                    path = os.path.join(folder, 'model.int8.onnx')
+                options = ort.SessionOptions()
+                options.intra_op_num_threads = 1
+                self.inference['session'] = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        return self.inference['session']
+
+    def get_quantized(self):
+        # a copy of the model with int8 weights for the linear layers, used for inference only
+        if 'quantized' not in self.inference:
+            model = self.__class__(self.game, self.args)
+            model.load_state_dict(self.state_dict())
+            model.eval()
+            self.inference['quantized'] = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+        return self.inference['quantized']
     
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
@@ -102,4 +159,5 @@ class NeuralNetModel(nn.Module):
             raise ("No model in path {}".format(filepath))
         map_location = None if self.args.cuda else 'cpu'
         checkpoint = torch.load(filepath, map_location=map_location)
-        self.load_state_dict(checkpoint['state_dict'])
\ No newline at end of file
+        self.load_state_dict(checkpoint['state_dict'])
+        self.inference.clear()
\ No newline at end of file
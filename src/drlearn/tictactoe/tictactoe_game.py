@@ -126,6 +126,12 @@ class TicTacToe(Game):
         s = state[0]
         return ','.join([str(s[x*self.n+y]) for x in range(self.n) for y in range(self.n)])
 
+    def get_state_key(self, state):
+        '''
+        the raw bytes of the board, cheaper to build than the string representation
+        '''
+        return state[0].tobytes()
+
     def play(self, state):
         valid = self.get_valid_actions(state, 1)
         for i in range(len(valid)):
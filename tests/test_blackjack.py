@@ -1,6 +1,7 @@
 import pytest
 import logging
 import os
+import numpy as np
 from drlearn.blackjack import BlackJack, BlackJackModel
 from drlearn import args, nnargs, MCTS
 from drlearn.blackjack import ACTION_HIT, ACTION_STAND, PLAYER, DEALER
@@ -8,12 +9,12 @@ from drlearn.blackjack import ACTION_HIT, ACTION_STAND, PLAYER, DEALER
 def test_blackjack_initial_state(setup_blackjack_game):
     game, model = setup_blackjack_game
     state = game.get_init_state()
-    assert len(state[0]) == 2  # Player's hand
-    assert len(state[1]) == 2  # Dealer's hand
+    assert state[0].sum() == 2  # Player's hand
+    assert state[1].sum() == 2  # Dealer's hand
 
 def test_blackjack_valid_actions(setup_blackjack_game):
     game, model = setup_blackjack_game
-    state = (['10', '7'], ['9', 'A'], 0, 0)
+    state = game.make_state(['10', '7'], ['9', 'A'], 0, 0)
     valids = game.get_valid_actions(state, 0)
     assert valids[0] == 1  # ACTION_HIT
     assert valids[1] == 1  # ACTION_STAND
@@ -22,7 +23,7 @@ def test_blackjack_next_state(setup_blackjack_game):
     game, model = setup_blackjack_game
     state = game.get_init_state()
     next_state = game.get_next_state(state, 0, 0)  # ACTION_HIT
-    assert len(next_state[0]) == 3  # Player's hand should have one more card
+    assert next_state[0].sum() == 3  # Player's hand should have one more card
 
 @pytest.mark.parametrize("state", [
     (['10', '7'], ['9', 'A'], DEALER, 0),
@@ -32,6 +33,7 @@ def test_blackjack_next_state(setup_blackjack_game):
 ])
 def test_blackjack_get_action_prob(setup_blackjack_game, state):
     game, model = setup_blackjack_game
+    state = game.make_state(*state)
     best_model_path = os.path.join(os.path.dirname(__file__), "../best_models")
     nnargs.num_channels = 512
     nnet = BlackJackModel(game, nnargs)
@@ -50,3 +52,47 @@ def test_blackjack_get_action_prob(setup_blackjack_game, state):
     pi = mcts.get_action_prob(state, temp=0)
     logging.debug(f"pi: {pi}")
 
+
+@pytest.mark.parametrize("dealer_hand, can_stand", [
+    (['A', '6'], 1),   # soft 17
+    (['A', '5'], 0),   # soft 16
+    (['A', 'A', '4'], 0),
+    (['A', 'K', '6'], 1),  # hard 17
+])
+def test_blackjack_ace_value(setup_blackjack_game, dealer_hand, can_stand):
+    game, model = setup_blackjack_game
+    state = game.make_state(dealer_hand, ['10', '7'], DEALER, 0)
+    valids = game.get_valid_actions(state, DEALER)
+    assert valids[ACTION_HIT] == 1
+    assert valids[ACTION_STAND] == can_stand
+
+def test_blackjack_onnx_predict(setup_blackjack_game):
+    pytest.importorskip("onnxruntime")
+    game, model = setup_blackjack_game
+    state_n = game.to_neural_state(game.get_init_state())
+    states = np.stack([state_n[0], state_n[1]])
+    nnargs.onnx = False
+    try:
+        pi, v = model.predict_batch(states)
+    finally:
+        nnargs.onnx = True
+    onnx_pi, onnx_v = model.predict_batch(states)
+    assert np.allclose(pi, onnx_pi, atol=1e-5) and np.allclose(v, onnx_v, atol=1e-5)
+
+@pytest.mark.parametrize("onnx", [False, True])
+def test_blackjack_quantized_predict(setup_blackjack_game, onnx):
+    if onnx:
+        pytest.importorskip("onnxruntime")
+    game, model = setup_blackjack_game
+    state_n = game.to_neural_state(game.get_init_state())
+    states = np.stack([state_n[0], state_n[1]])
+    nnargs.onnx = onnx
+    try:
+        pi, v = model.predict_batch(states)
+        nnargs.quantize = True
+        model.inference.clear()
+        quantized_pi, quantized_v = model.predict_batch(states)
+    finally:
+        nnargs.onnx = True
+        nnargs.quantize = False
+    assert np.allclose(pi, quantized_pi, atol=0.1) and np.allclose(v, quantized_v, atol=0.1)
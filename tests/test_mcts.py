@@ -2,12 +2,50 @@ import pytest
 
 from drlearn.blackjack import BlackJack, BlackJackModel
 from drlearn import args, nnargs, MCTS
+from drlearn.utils import DotDict
 
 def test_mcts():
     game = BlackJack()
     nnet = BlackJackModel(game, nnargs)
     dealer_nnet = BlackJackModel(game, nnargs)
     mcts = MCTS(game, nnet, dealer_nnet, args)
-    state = (['J','K'], ['10', '8'], -1, 0)
+    state = game.make_state(['J','K'], ['10', '8'], -1, 0)
     probs = mcts.get_action_prob(state) 
-    
\ No newline at end of file
+    
+def test_mcts_shared_leaf_cache():
+    game = BlackJack()
+    nnet = BlackJackModel(game, nnargs)
+    dealer_nnet = BlackJackModel(game, nnargs)
+    leaf_cache = {}
+    state = game.make_state(['J','K'], ['10', '8'], -1, 0)
+    s = game.get_state_key(state)
+    MCTS(game, nnet, dealer_nnet, args, leaf_cache).get_action_prob(state)
+    assert (s, -1) in leaf_cache
+    mcts = MCTS(game, nnet, dealer_nnet, args, leaf_cache)
+    mcts.get_action_prob(state)
+    assert mcts.ps[s] is leaf_cache[(s, -1)][0]
+
+def test_mcts_search_batch():
+    game = BlackJack()
+    nnet = BlackJackModel(game, nnargs)
+    dealer_nnet = BlackJackModel(game, nnargs)
+    batch_args = DotDict({**args, 'mcts_batch_size': 8})
+    mcts = MCTS(game, nnet, dealer_nnet, batch_args)
+    state = game.make_state(['5', '6'], ['10', '8'], 1, 0)
+    probs = mcts.get_action_prob(state)
+    s = game.get_state_key(state)
+    assert mcts.n[s].sum() == args.num_mcts_sims - 1
+    assert not any(vloss.any() for vloss in mcts.vloss.values()) and not any(mcts.vns.values())
+    assert abs(sum(probs) - 1) < 1e-6
+
+def test_mcts_rule_based_dealer():
+    game = BlackJack(rule_based_dealer=True)
+    nnet = BlackJackModel(game, nnargs)
+    # the dealer has no model, its nodes are expanded from the valid actions
+    mcts = MCTS(game, nnet, None, args)
+    state = game.make_state(['10', '7'], ['10', '8'], -1, 0)
+    probs = mcts.get_action_prob(state)
+    assert list(probs) == [0, 1]
+    state = game.make_state(['10', '5'], ['10', '8'], -1, 0)
+    probs = mcts.get_action_prob(state)
+    assert list(probs) == [1, 0]